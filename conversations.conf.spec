@@ -1,2 +1,10 @@
 # Number of seconds without activity before a conversation is closed.
 conversation_expires = integer(default=60)
+
+# Number of interactions after which the conversation continues in a new one.
+# Keeps conversation documents well below MongoDB's 16MB document limit.
+max_interactions = integer(min=1, default=1000)
+
+# Number of seconds closed conversations are kept before MongoDB purges them.
+# Set to 0 to keep all conversations.
+conversation_retention = integer(min=0, default=0)
@@ -3,19 +3,129 @@ Stores Eva conversation data in MongoDB and enable plugins to handle follow-up
 queries/commands from the clients.
 """
 
+import os
 import datetime
-from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
 from bson.objectid import ObjectId
+from pymongo import WriteConcern
 import mongoengine
 import gossip
 from eva import log
 from eva import conf
 
-mongoengine.connect(db=conf['mongodb']['database'],
-                    host=conf['mongodb']['host'],
-                    port=conf['mongodb']['port'],
-                    username=conf['mongodb']['username'],
-                    password=conf['mongodb']['password'])
+# Resolved once, this is checked on every interaction.
+_EXPIRES = conf['plugins']['conversations']['config']['conversation_expires']
+_EXPIRES_DELTA = datetime.timedelta(seconds=int(_EXPIRES))
+_MAX_INTERACTIONS = int(conf['plugins']['conversations']['config']['max_interactions'])
+_RETENTION = int(conf['plugins']['conversations']['config']['conversation_retention'])
+
+_INDEXES = [
+    # Open conversations are missing the closed field - they all sit at the
+    # front of this index, newest first.
+    {'fields': ['closed', '-id'], 'name': 'open_convos_desc'}
+]
+if _RETENTION:
+    # Let MongoDB purge closed conversations in the background.
+    _INDEXES.append({'fields': ['closed'], 'name': 'closed_ttl',
+                     'expireAfterSeconds': _RETENTION,
+                     'partialFilterExpression': {'closed': {'$exists': True}}})
+
+# GridFS chunk size used for the audio files (GridFS defaults to 255KB). Most
+# interaction audio fits in a single chunk document at this size.
+_AUDIO_CHUNK_SIZE = 1024 * 1024
+
+# Writes interactions in the background while plugins work on the interaction.
+# A single worker keeps the writes in order.
+_WRITER = ThreadPoolExecutor(max_workers=1)
+
+# Collection handles used by all the lookups and writes, resolved on first use
+# (see _ensure_connected). Always go through _get_conversations() and
+# _get_w0_conversations().
+_CONVERSATIONS = None
+# Unacknowledged writes, see Interaction.close().
+_W0_CONVERSATIONS = None
+
+# The stored form of the last known open conversation for this process. This is
+# only a hint to avoid re-fetching the conversation on every interaction -
+# MongoDB remains the source of truth whenever the cached conversation is
+# missing or expired. Each context still gets its own Conversation object.
+_CURRENT_CONVERSATION = None
+
+def _connect():
+    """
+    Registers the MongoDB connection with mongoengine.
+
+    With `connect=False` this doesn't touch the network, the client only
+    connects on its first operation. Other plugins using the documents (i.e.
+    `Conversation.objects`) rely on this connection being registered.
+    """
+    # Keep a warm connection pool so interactions don't pay for new connections.
+    mongoengine.connect(db=conf['mongodb']['database'],
+                        host=conf['mongodb']['host'],
+                        port=conf['mongodb']['port'],
+                        username=conf['mongodb']['username'],
+                        password=conf['mongodb']['password'],
+                        maxPoolSize=50,
+                        minPoolSize=5,
+                        maxIdleTimeMS=60000,
+                        retryWrites=True,
+                        w=1,
+                        compressors='zlib',
+                        connect=False)
+
+def _ensure_connected():
+    """
+    Resolves the collection handles (creating the indexes if needed) the first
+    time it is called in this process. Cheap on subsequent calls.
+
+    Doing this lazily keeps the import from blocking on the database, and lets
+    forked workers each create their own connection pool (see
+    :func:`_reset_after_fork`).
+    """
+    global _CONVERSATIONS, _W0_CONVERSATIONS #pylint: disable=W0603
+    if _CONVERSATIONS is not None:
+        return
+    _reconcile_ttl_index()
+    collection = Conversation._get_collection() #pylint: disable=W0212
+    _W0_CONVERSATIONS = collection.with_options(write_concern=WriteConcern(w=0))
+    _CONVERSATIONS = collection
+
+def _get_conversations():
+    """
+    Returns the conversations collection, connecting first if needed.
+
+    :rtype: :class:`pymongo.collection.Collection`
+    """
+    _ensure_connected()
+    return _CONVERSATIONS
+
+def _get_w0_conversations():
+    """
+    Returns the conversations collection with unacknowledged writes (w=0),
+    connecting first if needed.
+
+    :rtype: :class:`pymongo.collection.Collection`
+    """
+    _ensure_connected()
+    return _W0_CONVERSATIONS
+
+def _reset_after_fork():
+    """
+    Drops the state inherited from the parent process in a forked child: the
+    MongoDB client (not fork-safe), the background writer thread (not copied
+    by fork) and the cached conversation.
+    """
+    global _CONVERSATIONS, _W0_CONVERSATIONS, _WRITER, _CURRENT_CONVERSATION #pylint: disable=W0603
+    mongoengine.disconnect()
+    _connect()
+    _CONVERSATIONS = None
+    _W0_CONVERSATIONS = None
+    _WRITER = ThreadPoolExecutor(max_workers=1)
+    _CURRENT_CONVERSATION = None
+
+_connect()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork) #pylint: disable=E1101
 
 @gossip.register('eva.pre_interaction', provides=['conversations'])
 def pre_interaction(context):
@@ -24,39 +134,57 @@ def pre_interaction(context):
     execute before an interaction is initiated.
 
     This is where the :class:`Conversation` object is attached to the context.
-    Expired conversations will be closed and new conversations will be created
-    in this function. A new :class:`Interaction` is always added to the
-    conversation at the end of the function.
+    Expired conversations (and conversations that reached `max_interactions`)
+    will be closed and new conversations will be created in this function. A
+    new :class:`Interaction` is always added to the conversation at the end of
+    the function.
 
     :param context: The context object created for this interaction.
     :type context: :class:`eva.context.EvaContext`
     """
-    # Load the current conversation.
-    context.conversation = get_current_conversation()
-    if context.conversation is not None:
+    # A single timestamp is used for the expiry check and anything opened or
+    # closed below.
+    now = datetime.datetime.utcnow()
+    # Load the current conversation without deserializing it yet, using the
+    # one cached by the previous interaction if still active.
+    context.conversation = None
+    conversation = _get_cached_conversation(now) or _find_current_conversation()
+    if conversation is not None:
         # Close the conversation if past expiration.
-        expires = conf['plugins']['conversations']['config']['conversation_expires']
-        now = datetime.datetime.now()
-        current_interaction = context.conversation.get_current_interaction()
-        last_activity = current_interaction.closed
-        if last_activity is not None and now - last_activity > datetime.timedelta(seconds=expires):
-            log.info('Conversation expired - older than %s seconds' %expires)
-            context.conversation.close()
+        current_interaction = (conversation.get('interactions') or [{}])[-1]
+        last_activity = current_interaction.get('closed')
+        if last_activity is not None and now - last_activity > _EXPIRES_DELTA:
+            log.info('Conversation expired - older than %s seconds' %_EXPIRES)
+            _close_conversation(conversation['_id'], now)
         else:
             # Conversation not closed, potentially a follow-up query.
-            context.conversation.follow_up_plugin_id = current_interaction.responding_plugin_id
+            context.conversation = _load_partial_conversation(conversation)
+            context.conversation.follow_up_plugin_id = current_interaction.get('responding_plugin_id')
+    # Keep conversation documents bounded - continue in a new conversation
+    # once full, without losing the follow-up plugin.
+    follow_up_plugin_id = None
+    if context.conversation is not None and context.conversation.closed is None and \
+       context.conversation.interaction_count >= _MAX_INTERACTIONS:
+        log.info('Conversation full - reached %s interactions' %_MAX_INTERACTIONS)
+        follow_up_plugin_id = context.conversation.follow_up_plugin_id
+        context.conversation.close(now)
     # It's possible that a plugin has closed the conversation explicitly.
     # Also check if the conversation is set to closed.
-    if context.conversation is None or context.conversation.closed is not None:
+    new_conversation = context.conversation is None or context.conversation.closed is not None
+    if new_conversation:
         log.info('Creating new conversation')
         gossip.trigger('eva.conversations.pre_new_conversation')
-        context.conversation = Conversation()
-        # Save so that if someone calls get_current_conversation they get this one.
-        context.conversation.save()
-        gossip.trigger('eva.conversations.post_new_conversation')
+        # Allocate the ID now, the conversation is saved along with its first
+        # interaction below.
+        context.conversation = Conversation(id=ObjectId(), opened=now)
+        context.conversation.follow_up_plugin_id = follow_up_plugin_id
     # Create a new interaction.
     log.info('Creating new interaction')
-    context.conversation.create_interaction(context)
+    context.conversation.create_interaction(context, now)
+    # Cache so that if someone calls get_current_conversation they get this one.
+    _cache_conversation(context.conversation)
+    if new_conversation:
+        gossip.trigger('eva.conversations.post_new_conversation')
 
 @gossip.register('eva.interaction', priority=100)
 def interaction(context):
@@ -93,6 +221,9 @@ def pre_set_input_text(text, plugin_id, context):
     used to attach the input text alterations to the :class:`Interaction`
     object.
 
+    The alteration is only kept in memory here; it gets written to the database
+    along with the rest of the interaction in :meth:`Interaction.close`.
+
     :param text: The input text to be set.
     :type text: string
     :param plugin_id: The plugin that is setting the input text.
@@ -102,7 +233,6 @@ def pre_set_input_text(text, plugin_id, context):
     """
     inter = context.conversation.get_current_interaction()
     inter.add_input_alteration(text, plugin_id)
-    context.conversation.save()
 
 @gossip.register('eva.pre_set_output_text')
 def pre_set_output_text(text, responding, plugin_id, context):
@@ -111,6 +241,9 @@ def pre_set_output_text(text, responding, plugin_id, context):
     used to attach the output text alterations to the :class:`Interaction`
     object.
 
+    The alteration is only kept in memory here; it gets written to the database
+    along with the rest of the interaction in :meth:`Interaction.close`.
+
     :param text: The output text to be set.
     :type text: string
     :param responding: Whether or not this new output text is meant to be the
@@ -126,7 +259,6 @@ def pre_set_output_text(text, responding, plugin_id, context):
     """
     inter = context.conversation.get_current_interaction()
     inter.add_output_alteration(text, plugin_id, responding)
-    context.conversation.save()
 
 def get_current_conversation():
     """
@@ -135,10 +267,168 @@ def get_current_conversation():
     Will find the first conversation that does not have the `closed` field set,
     ordered by ObjectID DESC.
 
+    The conversation cached by this process is used if it is still active,
+    a new object is returned either way.
+
+    Only the latest interaction is loaded. Use the conversation's `reload()`
+    method to load all of its interactions.
+
     :return: The current active conversation object.
     :rtype: :class:`Conversation`
     """
-    return Conversation.objects(closed__exists=False).order_by('-id').first() #pylint: disable=E1101
+    conversation = _get_cached_conversation() or _find_current_conversation()
+    if conversation is None:
+        return None
+    return _load_partial_conversation(conversation)
+
+def _get_cached_conversation(now=None):
+    """
+    Returns the raw document of the conversation cached by this process, as
+    long as it hasn't gone without activity for longer than
+    `conversation_expires`.
+
+    :param now: The time to check expiration against (defaults to now).
+    :type now: :class:`datetime.datetime`
+    :return: The cached conversation document (or None).
+    :rtype: dict
+    """
+    now = now or datetime.datetime.utcnow()
+    conversation = _CURRENT_CONVERSATION
+    if conversation is None:
+        return None
+    last_activity = conversation['interactions'][-1].get('closed')
+    if last_activity is not None and now - last_activity > _EXPIRES_DELTA:
+        return None
+    return conversation
+
+def _cache_conversation(conversation):
+    """
+    Caches the stored form of the conversation for the next interactions of
+    this process (see :func:`_get_cached_conversation`). As with
+    :func:`_find_current_conversation`, only the last interaction is kept.
+
+    :param conversation: The conversation, with its current interaction.
+    :type conversation: :class:`Conversation`
+    """
+    global _CURRENT_CONVERSATION #pylint: disable=W0603
+    document = conversation.to_mongo(fields=['opened', 'interaction_count', 'closed']).to_dict()
+    document['interactions'] = [conversation.get_current_interaction().to_mongo().to_dict()]
+    _CURRENT_CONVERSATION = document
+
+def _is_cached_interaction(conversation_id, interaction_id):
+    """
+    Whether the specified interaction is the latest one of the cached
+    conversation.
+
+    :param conversation_id: The ID of the interaction's conversation.
+    :type conversation_id: :class:`bson.objectid.ObjectId`
+    :param interaction_id: The ID of the interaction.
+    :type interaction_id: :class:`bson.objectid.ObjectId`
+    :rtype: bool
+    """
+    conversation = _CURRENT_CONVERSATION
+    return conversation is not None and conversation['_id'] == conversation_id and \
+        conversation['interactions'][-1].get('id') == interaction_id
+
+def _forget_conversation(conversation_id):
+    """
+    Invalidates the cached conversation if it is the one specified.
+
+    :param conversation_id: The ID of the conversation being closed.
+    :type conversation_id: :class:`bson.objectid.ObjectId`
+    """
+    global _CURRENT_CONVERSATION #pylint: disable=W0603
+    if _CURRENT_CONVERSATION is not None and _CURRENT_CONVERSATION['_id'] == conversation_id:
+        _CURRENT_CONVERSATION = None
+
+def _find_current_conversation():
+    """
+    Fetches the raw document of the current active conversation straight from
+    the collection, skipping the mongoengine :class:`QuerySet` and
+    deserialization overhead.
+
+    Only the last interaction is returned in the `interactions` list (that's
+    all that is needed to continue the conversation).
+
+    :return: The current active conversation document (or None).
+    :rtype: dict
+    """
+    return _get_conversations().find_one({'closed': {'$exists': False}},
+                                         projection={'interactions': {'$slice': -1}},
+                                         sort=[('_id', -1)],
+                                         hint='open_convos_desc')
+
+def _load_partial_conversation(document):
+    """
+    Builds a :class:`Conversation` from a document holding only its last
+    interaction (see :func:`_find_current_conversation`). The conversation's
+    `save()` loads the remaining interactions before writing anything.
+
+    :param document: The raw conversation document.
+    :type document: dict
+    :return: The partially loaded conversation object.
+    :rtype: :class:`Conversation`
+    """
+    conversation = Conversation._from_son(document) #pylint: disable=W0212
+    conversation._partial = True #pylint: disable=W0212
+    return conversation
+
+def _close_conversation(conversation_id, now):
+    """
+    Closes the conversation with the given ID without loading it from the
+    database.
+
+    Will fire the `eva.conversations.pre_close_conversation` and
+    `eva.conversations.post_close_conversation` triggers.
+
+    :param conversation_id: The ID of the conversation to close.
+    :type conversation_id: :class:`bson.objectid.ObjectId`
+    :param now: The time to record as the conversation's closing time.
+    :type now: :class:`datetime.datetime`
+    """
+    gossip.trigger('eva.conversations.pre_close_conversation')
+    _get_conversations().update_one({'_id': conversation_id},
+                                    {'$set': {'closed': now}})
+    _forget_conversation(conversation_id)
+    gossip.trigger('eva.conversations.post_close_conversation')
+
+def _reconcile_ttl_index():
+    """
+    Brings an existing `closed_ttl` index in line with the
+    `conversation_retention` option before mongoengine ensures the indexes.
+
+    MongoDB refuses to recreate an index with different options, so a changed
+    retention is applied with `collMod`. The index is dropped when the
+    retention is set back to 0, which stops the purge.
+    """
+    collection = Conversation._get_db()[Conversation._meta['collection']] #pylint: disable=W0212
+    index = collection.index_information().get('closed_ttl')
+    if index is None:
+        return
+    if not _RETENTION:
+        log.info('Dropping the closed_ttl index - conversation_retention is 0')
+        collection.drop_index('closed_ttl')
+    elif index.get('expireAfterSeconds') != _RETENTION:
+        log.info('Updating the closed_ttl index - conversation_retention is %s' %_RETENTION)
+        collection.database.command({'collMod': collection.name,
+                                     'index': {'name': 'closed_ttl',
+                                               'expireAfterSeconds': _RETENTION}})
+
+def _alteration_to_bson(new_text, plugin_id):
+    """
+    Builds the stored form of a :class:`TextAlteration` directly, without going
+    through mongoengine's `to_mongo()`.
+
+    :param new_text: The new text for this alteration.
+    :type new_text: string
+    :param plugin_id: The plugin ID of the plugin performing this alteration.
+    :type plugin_id: string
+    :return: The alteration document, as stored in the interaction.
+    :rtype: dict
+    """
+    if plugin_id is None:
+        return {'new_text': new_text}
+    return {'new_text': new_text, 'plugin_id': plugin_id}
 
 class TextAlteration(mongoengine.EmbeddedDocument):
     """
@@ -161,7 +451,7 @@ class Interaction(mongoengine.EmbeddedDocument):
     Fields:
         id - :class:`mongoengine.fields.ObjectIdField`
             The unique identifier for this interaction.
-        opened - :class:`mongoengine.fields.DateTimeField` (Default=datetime.datetime.now)
+        opened - :class:`mongoengine.fields.DateTimeField` (Default=datetime.datetime.utcnow)
             The datetime that the interaction was created.
         input_text - :class:`mongoengine.fields.StringField`
             The query/command text used when starting this interaction.
@@ -184,7 +474,7 @@ class Interaction(mongoengine.EmbeddedDocument):
             The closing datetime for this interaction.
     """
     id = mongoengine.fields.ObjectIdField() #pylint: disable=C0103
-    opened = mongoengine.fields.DateTimeField(default=datetime.datetime.now)
+    opened = mongoengine.fields.DateTimeField(default=datetime.datetime.utcnow)
     input_text = mongoengine.fields.StringField()
     input_audio = mongoengine.fields.FileField()
     input_text_alterations = mongoengine.fields.EmbeddedDocumentListField(TextAlteration)
@@ -194,6 +484,12 @@ class Interaction(mongoengine.EmbeddedDocument):
     responding_plugin_id = mongoengine.fields.StringField()
     closed = mongoengine.fields.DateTimeField()
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Alterations not yet written to the database (see :meth:`close`).
+        self._unsaved_input_alterations = []
+        self._unsaved_output_alterations = []
+
     def parse_interaction_data(self, data):
         """
         Helper method to parse the interaction data submitted by the client and
@@ -210,20 +506,26 @@ class Interaction(mongoengine.EmbeddedDocument):
         """
         self.input_text = data.get('input_text', None)
         input_audio = data.get('input_audio', None)
-        if input_audio and 'audio' in input_audio and 'content_type' in input_audio:
+        if input_audio and input_audio.get('audio') and 'content_type' in input_audio:
             self.set_input_audio(input_audio)
 
     def set_input_audio(self, data):
         """
         Helper method to store the input audio in this interaction object.
+        Nothing is stored when the audio is empty.
 
         :param data: The interaction data received from the clients.
-            Expects a dict with the 'audio' and 'content_type' keys.
+            Expects a dict with the 'audio' (bytes or file-like object) and
+            'content_type' keys.
         :type data: dict
         """
-        audio = BytesIO(data['audio'])
+        # GridFS reads bytes and file-like objects directly, no need to copy.
+        audio = data.get('audio')
+        if not audio:
+            # Don't create an empty GridFS file.
+            return
         content_type = data['content_type']
-        self.input_audio.put(audio, content_type=content_type)
+        self.input_audio.put(audio, content_type=content_type, chunk_size=_AUDIO_CHUNK_SIZE)
 
     def add_input_alteration(self, new_text, plugin_id):
         """
@@ -235,7 +537,9 @@ class Interaction(mongoengine.EmbeddedDocument):
             alteration.
         :type plugin_id: string
         """
-        self.input_text_alterations.create(new_text=new_text, plugin_id=plugin_id) #pylint: disable=E1101
+        self._unsaved_input_alterations.append(_alteration_to_bson(new_text, plugin_id))
+        # Only kept in memory for plugins to read, the stored form is above.
+        self.input_text_alterations.append(TextAlteration(new_text=new_text, plugin_id=plugin_id)) #pylint: disable=E1101
 
     def add_output_alteration(self, new_text, plugin_id, responding=True):
         """
@@ -251,7 +555,9 @@ class Interaction(mongoengine.EmbeddedDocument):
             be set to the specified plugin_id.
         :type responding: boolean
         """
-        self.output_text_alterations.create(new_text=new_text, plugin_id=plugin_id) #pylint: disable=E1101
+        self._unsaved_output_alterations.append(_alteration_to_bson(new_text, plugin_id))
+        # Only kept in memory for plugins to read, the stored form is above.
+        self.output_text_alterations.append(TextAlteration(new_text=new_text, plugin_id=plugin_id)) #pylint: disable=E1101
         if responding:
             # Set the responding plugin.
             self.responding_plugin_id = plugin_id
@@ -264,7 +570,16 @@ class Interaction(mongoengine.EmbeddedDocument):
         `eva.conversations.post_close_interaction` triggers.
 
         Takes care of populating the output_text, output_audio, and closed
-        fields.
+        fields. This is where the interaction (including all the text
+        alterations gathered during the interaction) gets saved, only touching
+        this interaction's changed fields. This includes the changes made by
+        the `pre_close_interaction` hooks and the input audio stored with
+        :meth:`set_input_audio`.
+
+        The text alterations are informational only and are pushed with an
+        unacknowledged write (w=0): a crash or network error can lose them
+        without being noticed. The other fields use the default acknowledged
+        write concern.
 
         :param context: The context object created for this interaction.
         :type context: :class:`eva.context.EvaContext`
@@ -272,31 +587,97 @@ class Interaction(mongoengine.EmbeddedDocument):
         gossip.trigger('eva.conversations.pre_close_interaction', context=context)
         self.output_text = context.get_output_text()
         self.set_output_audio(context)
-        self.closed = datetime.datetime.now()
-        context.conversation.save()
+        self.closed = datetime.datetime.utcnow()
+        query = {'_id': context.conversation.id, 'interactions.id': self.id}
+        context.conversation.wait_for_write()
+        alterations_update = self._get_alterations_update()
+        if alterations_update:
+            _get_w0_conversations().update_one(query, alterations_update)
+        _get_conversations().update_one(query, self._get_close_update())
+        del self._unsaved_input_alterations[:]
+        del self._unsaved_output_alterations[:]
+        self._clear_changed_fields()
+        context.conversation._clear_changed_fields() #pylint: disable=W0212
+        if _is_cached_interaction(context.conversation.id, self.id):
+            # Unless a newer interaction was created since.
+            _cache_conversation(context.conversation)
         gossip.trigger('eva.conversations.post_close_interaction', context=context)
 
+    def _get_close_update(self):
+        """
+        Builds the update document used to save this interaction when closed.
+        Every field changed since the interaction was created (or loaded) is
+        saved, the text alterations are only ever appended.
+
+        Targets the interaction through the positional operator, so the query
+        must match on `interactions.id`.
+
+        :return: The MongoDB update document.
+        :rtype: dict
+        """
+        document = self.to_mongo()
+        changed = {field.split('.')[0] for field in self._get_changed_fields()}
+        changed.difference_update(['input_text_alterations', 'output_text_alterations'])
+        update = {'$set': {'interactions.$.%s' %field: document[field]
+                           for field in changed if field in document}}
+        unset = {'interactions.$.%s' %field: '' for field in changed if field not in document}
+        if unset:
+            update['$unset'] = unset
+        return update
+
+    def _get_alterations_update(self):
+        """
+        Builds the update document pushing the text alterations that have not
+        been written to the database yet.
+
+        Targets the interaction through the positional operator, so the query
+        must match on `interactions.id`.
+
+        :return: The MongoDB update document (or None if nothing to push).
+        :rtype: dict
+        """
+        alterations = {
+            'input_text_alterations': self._unsaved_input_alterations,
+            'output_text_alterations': self._unsaved_output_alterations
+        }
+        push = {'interactions.$.%s' %field: {'$each': unsaved}
+                for field, unsaved in alterations.items() if unsaved}
+        if not push:
+            return None
+        return {'$push': push}
+
     def set_output_audio(self, context):
         """
         A helper method to store the interaction's output_audio based on the
-        context object provided.
+        context object provided. Nothing is stored when there is no output
+        audio.
 
         :param context: The context object created for this interaction.
         :type context: :class:`eva.context.EvaContext`
         """
-        audio = BytesIO(context.get_output_audio())
+        # GridFS reads bytes and file-like objects directly, no need to copy.
+        audio = context.get_output_audio()
+        if not audio:
+            # Text-only interaction, don't create an empty GridFS file.
+            return
         content_type = context.get_output_audio_content_type()
-        self.output_audio.put(audio, content_type=content_type)
+        self.output_audio.put(audio, content_type=content_type, chunk_size=_AUDIO_CHUNK_SIZE)
 
 class Conversation(mongoengine.Document):
     """
     :class:`mongoengine.Document` object used to track Eva conversations.
 
+    Conversations attached to the context only have their latest
+    interactions loaded - use `reload()` to get all of them.
+
     Fields:
-        opened - :class:`mongoengine.fields.DateTimeField` (Default=datetime.datetime.now)
+        opened - :class:`mongoengine.fields.DateTimeField` (Default=datetime.datetime.utcnow)
             The datetime that the conversation was created.
         interactions - :class:`mongoengine.fields.EmbeddedDocumentListField`
             The list of :class:`Interaction` objects tied to this conversation.
+        interaction_count - :class:`mongoengine.fields.IntField` (Default=0)
+            The number of interactions in this conversation. Used to cap the
+            size of the conversation document.
         closed - :class:`mongoengine.fields.DateTimeField`
             The datetime that the conversation was closed.
         follow_up_plugin_id - string
@@ -304,48 +685,156 @@ class Conversation(mongoengine.Document):
             trigger on the next interaction.
         meta - dict
             Specifies that we're using the 'conversations' collection to store
-            conversation objects in the database.
+            conversation objects in the database, and the indexes used to find
+            the current (open) conversation and to purge closed conversations
+            (when `conversation_retention` is set).
     """
-    opened = mongoengine.fields.DateTimeField(default=datetime.datetime.now)
+    opened = mongoengine.fields.DateTimeField(default=datetime.datetime.utcnow)
     interactions = mongoengine.fields.EmbeddedDocumentListField(Interaction)
+    interaction_count = mongoengine.fields.IntField(default=0)
     closed = mongoengine.fields.DateTimeField()
     follow_up_plugin_id = None
-    meta = {'collection': 'conversations'}
+    _pending_write = None
+    _pending_insert = False
+    _current_interaction = None
+    # Whether only the latest interactions are loaded in `interactions`.
+    _partial = False
+    meta = {'collection': 'conversations', 'indexes': _INDEXES}
 
     def get_current_interaction(self):
         """
         Helper method that returns the current :class:`Interaction` (the last
         one in the database).
+
+        The interaction is remembered until the next one is created, so the
+        same object (holding the alterations not saved yet) is returned even
+        after a `reload()`.
         """
-        return self.interactions[-1] #pylint: disable=E1136
+        if self._current_interaction is None:
+            self._current_interaction = self.interactions[-1] #pylint: disable=E1136
+        return self._current_interaction
 
-    def create_interaction(self, context):
+    def create_interaction(self, context, opened=None):
         """
         Helper method that creates a new interaction based on the context
         specified. Will add the first input alteration based on the context's
         input_text.
 
+        A conversation that has not been saved yet is inserted along with this
+        interaction, otherwise the interaction is pushed to the stored
+        conversation. The IDs are allocated up front so the write runs in the
+        background while the plugins work on the interaction; any later write
+        to this conversation waits for it first (see :meth:`wait_for_write`).
+
         Will fire the `eva.conversations.pre_create_interaction` and
         `eva.conversations.post_create_interaction` triggers.
 
         :param context: The context object created for the current interaction.
         :type context: :class:`eva.context.EvaContext`
+        :param opened: The time the interaction was opened (defaults to now).
+        :type opened: :class:`datetime.datetime`
         """
         gossip.trigger('eva.conversations.pre_create_interaction', context=context)
+        # Don't lose track of a previous write that was never waited for.
+        self.wait_for_write()
         text = context.get_input_text()
-        inter = self.interactions.create(id=ObjectId(), input_text=text) #pylint: disable=E1101
-        inter.add_input_alteration(text, None)
-        self.save()
+        inter = Interaction(id=ObjectId(), opened=opened or datetime.datetime.utcnow(),
+                            input_text=text,
+                            input_text_alterations=[TextAlteration(new_text=text)])
+        self.interactions.append(inter) #pylint: disable=E1101
+        self.interaction_count += 1
+        self._current_interaction = inter
+        if self._created:
+            # New conversation, insert it along with its first interaction.
+            write = (_get_conversations().insert_one, self.to_mongo())
+            self._created = False
+            self._pending_insert = True
+        else:
+            # Push the new interaction instead of re-sending the whole list.
+            write = (_get_conversations().update_one, {'_id': self.id},
+                     {'$push': {'interactions': inter.to_mongo()}, '$inc': {'interaction_count': 1}})
+        # Considered stored from now on.
+        self._clear_changed_fields()
+        self._pending_write = _WRITER.submit(*write)
         gossip.trigger('eva.conversations.post_create_interaction', context=context)
 
-    def close(self):
+    def wait_for_write(self):
+        """
+        Helper method that blocks until the background write started by
+        :meth:`create_interaction` is done. Re-raises the write's error if it
+        failed.
+
+        A conversation that could not be written is no longer cached, so the
+        next interaction looks up (or creates) the current conversation again.
+        """
+        if self._pending_write is None:
+            return
+        pending_write, self._pending_write = self._pending_write, None
+        pending_insert, self._pending_insert = self._pending_insert, False
+        try:
+            result = pending_write.result()
+        except Exception:
+            _forget_conversation(self.id)
+            if pending_insert:
+                # Still not stored, a later save() must insert it.
+                self._created = True
+            raise
+        if not pending_insert and result.matched_count == 0:
+            log.warning('Conversation %s not found - new interaction not stored' %self.id)
+            _forget_conversation(self.id)
+
+    def save(self, *args, **kwargs): #pylint: disable=W0221
+        """
+        Saves the conversation, see :meth:`mongoengine.Document.save`.
+
+        When only the latest interactions are loaded, the stored interactions
+        are loaded first (keeping the objects already in memory) and the whole
+        list gets saved. Changes are tracked by position in the list, saving a
+        partial list would overwrite the wrong interactions.
+        """
+        self.wait_for_write()
+        if self._partial:
+            loaded = {inter.id: inter for inter in self.interactions} #pylint: disable=E1133
+            stored = _get_conversations().find_one({'_id': self.id}, projection={'interactions': 1})
+            if stored is not None:
+                interactions = [loaded.pop(raw.get('id'), None) or Interaction._from_son(raw) #pylint: disable=W0212
+                                for raw in stored.get('interactions', [])]
+                self.interactions = interactions + list(loaded.values())
+                self._mark_as_changed('interactions')
+            self._partial = False
+        super().save(*args, **kwargs)
+        # The alterations in memory have all been written along with the rest.
+        for inter in self.interactions: #pylint: disable=E1133
+            del inter._unsaved_input_alterations[:] #pylint: disable=W0212
+            del inter._unsaved_output_alterations[:] #pylint: disable=W0212
+        return self
+
+    def reload(self, *fields, **kwargs):
+        """
+        Reloads the conversation from the database, see
+        :meth:`mongoengine.Document.reload`. Loads all of the interactions
+        unless `fields` excludes them.
+        """
+        self.wait_for_write()
+        super().reload(*fields, **kwargs)
+        if not fields or 'interactions' in fields:
+            self._partial = False
+        return self
+
+    def close(self, closed=None):
         """
         Helper method to close the current conversation.
 
         Will fire the `eva.conversations.pre_close_conversation` and
         `eva.conversations.post_close_conversation` triggers.
+
+        :param closed: The time to record as the closing time (defaults to now).
+        :type closed: :class:`datetime.datetime`
         """
         gossip.trigger('eva.conversations.pre_close_conversation')
-        self.closed = datetime.datetime.now()
-        self.save()
+        self.closed = closed or datetime.datetime.utcnow()
+        self.wait_for_write()
+        _get_conversations().update_one({'_id': self.id}, {'$set': {'closed': self.closed}})
+        _forget_conversation(self.id)
         gossip.trigger('eva.conversations.post_close_conversation')
+